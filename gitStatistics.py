@@ -2,31 +2,38 @@ import requests
 import argparse
 import os
 import json
+import io
+import re
+import collections
+import contextlib
+import cProfile
+import tracemalloc
 import sys
 import csv
+import gzip
 import textwrap
 import datetime
-import matplotlib.pyplot as plt
-from matplotlib.transforms import Bbox
-from matplotlib.backends.backend_pdf import PdfPages
+import concurrent.futures
+import sqlite3
+import threading
+import time
+import random
+import subprocess
+import itertools
+import fnmatch
+import functools
+import importlib.util
+import queue
 import numpy as np
-from wordcloud import WordCloud, STOPWORDS
 import urllib3
 
 # just to prevent unnecessary logging since we are not verifying the host
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-queryBase = """
-query($repo: String!, $owner: String!, $branch: String!)
-{
-    repository(name: $repo, owner: $owner){
-    ref(qualifiedName: $branch) {
-      target {
-        ... on Commit {
-          id
-        history(since: "2015-01-01T01:01:00") {
+historyFields = """
             pageInfo {
               hasNextPage
+              endCursor
             }
             edges {
               node {
@@ -40,7 +47,26 @@ query($repo: String!, $owner: String!, $branch: String!)
                 }
               }
             }
-          }
+"""
+
+#Requested alongside every query so the scheduler can track the remaining budget
+rateLimitFields = """
+  rateLimit {
+    cost
+    remaining
+    resetAt
+  }
+"""
+
+queryBase = """
+query($repo: String!, $owner: String!, $branch: String!, $cursor: String, $since: GitTimestamp, $until: GitTimestamp)
+{""" + rateLimitFields + """
+    repository(name: $repo, owner: $owner){
+    ref(qualifiedName: $branch) {
+      target {
+        ... on Commit {
+          id
+        history(first: 100, after: $cursor, since: $since, until: $until) {""" + historyFields + """          }
         }
       }
     }
@@ -48,13 +74,935 @@ query($repo: String!, $owner: String!, $branch: String!)
 }
 """
 
+refFields = """
+      pageInfo {
+        hasNextPage
+        endCursor
+      }
+      nodes {
+        name
+      }
+"""
+
+#Branch names of a repository, needed when --branch is omitted or holds a glob
+refsQuery = """
+query($repo: String!, $owner: String!, $cursor: String)
+{""" + rateLimitFields + """
+    repository(name: $repo, owner: $owner){
+    defaultBranchRef {
+      name
+    }
+    refs(refPrefix: "refs/heads/", first: 100, after: $cursor) {""" + refFields + """    }
+  }
+}
+"""
+
+#Selections used by batched queries, each is placed under the i-th aliased repository(...) lookup
+existsSelection = """
+    ref(qualifiedName: $branch%(i)d) {
+      target {
+        oid
+      }
+    }
+"""
+
+refsSelection = """
+    defaultBranchRef {
+      name
+    }
+    refs(refPrefix: "refs/heads/", first: 100) {""" + refFields + """    }
+"""
+
+firstPageSelection = """
+    ref(qualifiedName: $branch%(i)d) {
+      target {
+        ... on Commit {
+          id
+        history(first: 100, since: $since, until: $until) {""" + historyFields + """          }
+        }
+      }
+    }
+"""
+
+def selectBranches(patterns, names, default):
+    #Branches out of names matching patterns, which are branch names or fnmatch globs, in pattern order with the
+    #default branch first as other branches mostly join its history. No patterns selects just the default branch
+    if not patterns:
+        return [default] if default else []
+    selected = []
+    for pattern in patterns:
+        selected += [name for name in names if fnmatch.fnmatchcase(name, pattern) and name not in selected]
+    if default in selected:
+        selected.remove(default)
+        selected.insert(0, default)
+    return selected
+
+def localBranches(path):
+    #Names of the local branches of a cloned repository
+    output = subprocess.run(["git", "-C", path, "for-each-ref", "--format=%(refname:short)", "refs/heads/"],
+        stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, universal_newlines = True).stdout
+    return output.split()
+
+def localHistory(path, branches, since):
+    #Stream the commits of a cloned repository from git log in the same shape the GraphQL API returns them.
+    #Each record starts with a \x1e and its fields are \x1f separated, the --numstat lines follow the message.
+    #git log lists commits shared by several branches only once
+    command = ["git", "-C", path, "log", "--numstat", "--no-color", "--format=%x1e%H%x1f%an%x1f%aI%x1f%B%x1f"]
+    if since is not None:
+        command.append("--since=@%d" % since)
+    #the -- keeps branches named like a file or directory of the working tree from being ambiguous
+    command += branches + ["--"]
+    process = subprocess.Popen(command, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    record = []
+    for line in io.TextIOWrapper(process.stdout, encoding = 'utf-8', errors = 'replace'):
+        if line.startswith("\x1e") and record:
+            yield parseLocalCommit("".join(record))
+            record = []
+        record.append(line)
+    if record:
+        yield parseLocalCommit("".join(record))
+    errors = process.stderr.read().decode('utf-8', errors = 'replace').strip()
+    if process.wait() != 0:
+        print("git log failed for", path + ":", errors)
+
+def parseLocalCommit(record):
+    oid, name, date, message, numstat = record[1:].split("\x1f")
+    additions = 0
+    deletions = 0
+    for line in numstat.splitlines():
+        line = line.split("\t")
+        if len(line) == 3 and line[0] != "-":#binary files report - instead of line counts
+            additions += int(line[0])
+            deletions += int(line[1])
+    return {"node":{"oid":oid, "message":message.strip(), "additions":additions, "deletions":deletions,
+        "author":{"name":name, "date":date}}}
+
+def readLocalTable(path, repository, branches, since, startTime, endTime, wordLimit):
+    #Process pool entry point, ingests the history of a cloned repository into a commit table of its own, which is
+    #far more compact to hand back than the commits themselves. Returns the table and its ingestCommit outcomes
+    table = commitTable(wordLimit)
+    outcomes = collections.Counter(ingestCommit(table, commit, repository, startTime, endTime) for commit in localHistory(path, branches, since))
+    return table, outcomes
+
+def pyplot():
+    #matplotlib and wordcloud are only imported by the reports drawing with them, importing them up front was most
+    #of the start up time and memory of runs that only fetch, write CSVs or grant awards
+    import matplotlib
+    matplotlib.use("Agg")#reports are only ever written to file, never shown
+    import matplotlib.pyplot
+    return matplotlib.pyplot
+
+@functools.lru_cache(maxsize = None)
+def loadStopwords():
+    #The stopwords WordCloud removes, read from the list shipped in its package without importing it.
+    #Only word clouds need the package, without it words are counted with no stopwords removed
+    spec = importlib.util.find_spec("wordcloud")
+    if spec is None:
+        print("wordcloud is not installed, commit message words are counted without removing stopwords")
+        return frozenset()
+    with open(os.path.join(spec.submodule_search_locations[0], "stopwords")) as stopwords:
+        return frozenset(word.strip().lower() for word in stopwords)
+
+#Words as WordCloud splits them
+tokenPattern = re.compile(r"\w[\w']*")
+
+def tokenize(message, stopwords):
+    #Lower cased words of a commit message, without possessive 's, plain numbers or stopwords
+    words = []
+    for word in tokenPattern.findall(message.lower()):
+        if word.endswith("'s"):
+            word = word[:-2]
+        if word and not word.isdigit() and word not in stopwords:
+            words.append(word)
+    return words
+
+def normalizePlurals(frequencies):
+    #Fold plurals into their singular when both were used, as WordCloud does for raw text
+    frequencies = dict(frequencies)
+    for word in list(frequencies):
+        if word.endswith("s") and not word.endswith("ss") and word[:-1] in frequencies:
+            frequencies[word[:-1]] += frequencies.pop(word)
+    return frequencies
+
+def renderWordCloud(frequencies, maxWords):
+    #Process pool entry point, rasterizes one user's word cloud and hands back the pixels
+    from wordcloud import WordCloud
+    wordcloud = WordCloud(width = 800, height = 800,
+    background_color ='#d5d8de',
+    max_words = maxWords or 200,
+    min_font_size = 1,
+    colormap='Blues').generate_from_frequencies(normalizePlurals(frequencies))
+    return wordcloud.to_array()
+
+class commitTable:
+    #Append only columnar store of ingested commits, one typed array per field. Rows are only ever appended
+    #while ingesting, the per user aggregates the reports read are computed from it in vectorized passes
+    #Object ids are SHA-1 hex, SHA-256 ones keep their first 40 characters which are still unique in practice
+    #tokenEnd is where each row's words end in the tokens array, they start where the previous row's end
+    columns = {"oid":"S40", "author":np.int32, "repo":np.int32, "epoch":np.float64, "additions":np.int64, "deletions":np.int64, "weekday":np.int8, "hour":np.int8, "words":np.int32, "tokenEnd":np.int64}
+
+    def __init__(self, wordLimit = None):
+        self.size = 0
+        self.data = {name:np.zeros(1024, dtype) for name, dtype in self.columns.items()}
+        #per author state, indexed by the author column
+        self.authors = []
+        self.authorIds = {}
+        self.wordCounts = []#word frequencies of all of an author's commit messages
+        self.shortest = []
+        self.longest = []
+        #repository names, indexed by the repo column
+        self.repositories = []
+        self.repositoryIds = {}
+        self.oids = set()#every ingested commit, a commit reachable from several repositories or branches is only kept once
+        #Word ids of every row's message, so tables can be combined without counting the words of a commit twice
+        self.vocabulary = []
+        self.vocabularyIds = {}
+        self.tokens = np.zeros(4096, np.int32)
+        self.tokenCount = 0
+        self.indexed = 0#rows covered by the window query index, see index()
+        #Frequencies are trimmed back to the wordLimit most common words whenever they grow past twice that,
+        #bounding memory per author at the cost of approximate counts for the rarest words
+        self.wordLimit = wordLimit
+        self.stopwords = loadStopwords()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, oid):
+        return oid in self.oids
+
+    def reserve(self, size):
+        #double capacity until size rows fit, so appends stay amortized O(1)
+        capacity = len(self.data["epoch"])
+        while capacity < size:
+            capacity *= 2
+        if capacity != len(self.data["epoch"]):
+            for name in self.data:
+                column = np.zeros(capacity, self.data[name].dtype)
+                column[:self.size] = self.data[name][:self.size]
+                self.data[name] = column
+
+    def reserveTokens(self, size):
+        capacity = len(self.tokens)
+        while capacity < size:
+            capacity *= 2
+        if capacity != len(self.tokens):
+            tokens = np.zeros(capacity, np.int32)
+            tokens[:self.tokenCount] = self.tokens[:self.tokenCount]
+            self.tokens = tokens
+
+    def wordId(self, word):
+        wordId = self.vocabularyIds.get(word)
+        if wordId is None:
+            wordId = self.vocabularyIds[word] = len(self.vocabulary)
+            self.vocabulary.append(word)
+        return wordId
+
+    def authorId(self, author, shortest, longest):
+        #Id of author, registering them with their first messages if they are new.
+        #Otherwise ties on message length go to the messages seen first
+        authorId = self.authorIds.get(author)
+        if authorId is None:
+            authorId = self.authorIds[author] = len(self.authors)
+            self.authors.append(author)
+            self.wordCounts.append(collections.Counter())
+            self.shortest.append(shortest)
+            self.longest.append(longest)
+        else:
+            if len(shortest) < len(self.shortest[authorId]):
+                self.shortest[authorId] = shortest
+            if len(longest) > len(self.longest[authorId]):
+                self.longest[authorId] = longest
+        return authorId
+
+    def repositoryId(self, repository):
+        repositoryId = self.repositoryIds.get(repository)
+        if repositoryId is None:
+            repositoryId = self.repositoryIds[repository] = len(self.repositories)
+            self.repositories.append(repository)
+        return repositoryId
+
+    def addWords(self, authorId, words):
+        wordCounts = self.wordCounts[authorId]
+        wordCounts.update(words)
+        if self.wordLimit and len(wordCounts) > 2*self.wordLimit:
+            self.wordCounts[authorId] = collections.Counter(dict(wordCounts.most_common(self.wordLimit)))
+
+    def append(self, repository, oid, author, epoch, additions, deletions, weekday, hour, message):
+        self.reserve(self.size + 1)
+        self.oids.add(oid)
+        authorId = self.authorId(author, message, message)
+        words = tokenize(message, self.stopwords)
+        self.addWords(authorId, words)
+        self.reserveTokens(self.tokenCount + len(words))
+        self.tokens[self.tokenCount:self.tokenCount + len(words)] = [self.wordId(word) for word in words]
+        self.tokenCount += len(words)
+        row = self.size
+        self.data["author"][row] = authorId
+        self.data["repo"][row] = self.repositoryId(repository)
+        self.data["oid"][row] = oid.encode()
+        self.data["epoch"][row] = epoch
+        self.data["additions"][row] = additions
+        self.data["deletions"][row] = deletions
+        self.data["weekday"][row] = weekday
+        self.data["hour"][row] = hour
+        self.data["words"][row] = len(message.split(" "))
+        self.data["tokenEnd"][row] = self.tokenCount
+        self.size += 1
+
+    def column(self, name):
+        return self.data[name][:self.size]
+
+    def extend(self, other):
+        #Append every commit of another table, as if they had been ingested after this table's own. Commits this
+        #table already has are skipped, words included, so the word frequencies of the rows that are appended
+        #are counted again from their tokens rather than taken from the other table
+        authorIds = np.array([self.authorId(author, other.shortest[i], other.longest[i]) for i, author in enumerate(other.authors)], np.int32)
+        repositoryIds = np.array([self.repositoryId(repository) for repository in other.repositories], np.int32)
+        wordIds = np.array([self.wordId(word) for word in other.vocabulary], np.int64)
+        oids = other.column("oid").astype(str)
+        new = np.fromiter((oid not in self.oids for oid in oids), bool, other.size)
+        self.oids.update(oids[new].tolist())
+        size = int(np.count_nonzero(new))
+        lengths = np.diff(other.column("tokenEnd"), prepend = 0)
+        tokens = wordIds[other.tokens[:other.tokenCount][np.repeat(new, lengths)]]
+        lengths = lengths[new]
+        #(author, word) pairs of the appended rows, counted in one pass
+        vocabularySize = max(1, len(self.vocabulary))
+        pairs, counts = np.unique(np.repeat(authorIds[other.column("author")[new]], lengths)*np.int64(vocabularySize) + tokens, return_counts = True)
+        pairs = zip((pairs//vocabularySize).tolist(), (pairs%vocabularySize).tolist(), counts.tolist())
+        for authorId, group in itertools.groupby(pairs, lambda pair: pair[0]):
+            self.addWords(authorId, {self.vocabulary[wordId]:count for _, wordId, count in group})
+        self.reserve(self.size + size)
+        for name in self.data:
+            column = other.column(name)[new]
+            if name == "author":
+                column = authorIds[column]
+            elif name == "repo":
+                column = repositoryIds[column]
+            elif name == "tokenEnd":
+                column = self.tokenCount + np.cumsum(lengths)
+            self.data[name][self.size:self.size + size] = column
+        self.reserveTokens(self.tokenCount + len(tokens))
+        self.tokens[self.tokenCount:self.tokenCount + len(tokens)] = tokens
+        self.tokenCount += len(tokens)
+        self.size += size
+
+    def export(self, path):
+        #Per commit columns as a .npz, repo and author hold indexes into the repositories and authors arrays
+        np.savez_compressed(path, oid = self.column("oid"), repo = self.column("repo"), author = self.column("author"),
+            epoch = self.column("epoch"), additions = self.column("additions"), deletions = self.column("deletions"),
+            repositories = np.array(self.repositories, str), authors = np.array(self.authors, str))
+
+    def save(self, path):
+        #Write the table as a partial aggregate, word frequencies are flattened into parallel arrays
+        wordAuthors = [i for i, words in enumerate(self.wordCounts) for word in words]
+        words = [word for wordCounts in self.wordCounts for word in wordCounts]
+        counts = [count for wordCounts in self.wordCounts for count in wordCounts.values()]
+        with open(path, 'wb') as output:
+            np.savez_compressed(output, authors = np.array(self.authors, dtype = str), repositories = np.array(self.repositories, dtype = str),
+                shortest = np.array(self.shortest, dtype = str), longest = np.array(self.longest, dtype = str),
+                wordAuthors = np.array(wordAuthors, np.int32), wordList = np.array(words, dtype = str), wordCounts = np.array(counts, np.int64),
+                vocabulary = np.array(self.vocabulary, dtype = str), tokens = self.tokens[:self.tokenCount],
+                **{name:self.column(name) for name in self.columns})
+
+    @classmethod
+    def load(cls, path, wordLimit = None):
+        table = cls(wordLimit)
+        with np.load(path) as partial:
+            table.authors = partial["authors"].tolist()
+            table.authorIds = {author:i for i, author in enumerate(table.authors)}
+            table.repositories = partial["repositories"].tolist()
+            table.repositoryIds = {repository:i for i, repository in enumerate(table.repositories)}
+            table.shortest = partial["shortest"].tolist()
+            table.longest = partial["longest"].tolist()
+            table.wordCounts = [collections.Counter() for author in table.authors]
+            for i, word, count in zip(partial["wordAuthors"].tolist(), partial["wordList"].tolist(), partial["wordCounts"].tolist()):
+                table.wordCounts[i][word] = count
+            table.vocabulary = partial["vocabulary"].tolist()
+            table.vocabularyIds = {word:i for i, word in enumerate(table.vocabulary)}
+            table.reserveTokens(len(partial["tokens"]))
+            table.tokenCount = len(partial["tokens"])
+            table.tokens[:table.tokenCount] = partial["tokens"]
+            table.reserve(len(partial["epoch"]))
+            table.size = len(partial["epoch"])
+            for name in cls.columns:
+                table.data[name][:table.size] = partial[name]
+            table.oids = set(table.column("oid").astype(str).tolist())
+        return table
+
+    def index(self):
+        #Orders of the rows used to answer window queries by bisecting: every row by commit time, and rows grouped
+        #by author and by repository, each group by commit time. Only rebuilt once rows have been appended since
+        if self.indexed == self.size and self.size != 0:
+            return
+        epoch = self.column("epoch")
+        self.byTime = np.argsort(epoch, kind = 'stable')
+        self.byTimeEpoch = epoch[self.byTime]
+        self.byAuthor = np.lexsort((epoch, self.column("author")))
+        self.byAuthorEpoch = epoch[self.byAuthor]
+        self.authorBounds = np.searchsorted(self.column("author")[self.byAuthor], np.arange(len(self.authors) + 1))
+        self.byRepository = np.lexsort((epoch, self.column("repo")))
+        self.byRepositoryEpoch = epoch[self.byRepository]
+        self.repositoryBounds = np.searchsorted(self.column("repo")[self.byRepository], np.arange(len(self.repositories) + 1))
+        self.indexed = self.size
+
+    @staticmethod
+    def window(order, epoch, start, end, low = 0, high = None):
+        #Rows of order[low:high] whose times, epoch[low:high], fall in [start, end)
+        high = len(order) if high is None else high
+        if start is not None:
+            low = low + np.searchsorted(epoch[low:high], start, 'left')
+        if end is not None:
+            high = low + np.searchsorted(epoch[low:high], end, 'left')
+        return order[low:high]
+
+    def select(self, start = None, end = None, authors = None, repositories = None):
+        #Rows of the commits made in [start, end) epoch seconds, by any of authors and in any of repositories when given
+        self.index()
+        if authors is not None:
+            ids = [self.authorIds[author] for author in authors if author in self.authorIds]
+            rows = [self.window(self.byAuthor, self.byAuthorEpoch, start, end, self.authorBounds[i], self.authorBounds[i+1]) for i in ids]
+            rows = np.concatenate(rows) if rows else np.zeros(0, np.int64)
+            if repositories is not None:
+                ids = [self.repositoryIds[repository] for repository in repositories if repository in self.repositoryIds]
+                rows = rows[np.isin(self.column("repo")[rows], ids)]
+        elif repositories is not None:
+            ids = [self.repositoryIds[repository] for repository in repositories if repository in self.repositoryIds]
+            rows = [self.window(self.byRepository, self.byRepositoryEpoch, start, end, self.repositoryBounds[i], self.repositoryBounds[i+1]) for i in ids]
+            rows = np.concatenate(rows) if rows else np.zeros(0, np.int64)
+        else:
+            rows = self.window(self.byTime, self.byTimeEpoch, start, end)
+        return rows
+
+    def summaryArrays(self, rows = None):
+        #Per user arrays over every commit or only the given rows, for users with at least one such commit in
+        #author order: names, additions, deletions, commits, weekdays (users x 7), nightOwl, earlyBird, words,
+        #times (commit times grouped by user in time order, user i's from bounds[i] to bounds[i+1]),
+        #intervalMean and intervalVariation (mean and coefficient of variation in percent of the intervals between
+        #a user's commits, NaN below three commits or with no time between them) and the per author wordCounts,
+        #shortest and longest messages, which always cover every commit
+        column = self.column if rows is None else lambda name: self.column(name)[rows]
+        users = len(self.authors)
+        author = column("author")
+        hour = column("hour")
+        epoch = column("epoch")
+        commits = np.bincount(author, minlength = users)
+        keep = np.flatnonzero(commits)
+        total = lambda weights: np.bincount(author, weights = weights, minlength = users).astype(np.int64)[keep]
+        weekdays = np.bincount(author.astype(np.int64)*7 + column("weekday"), minlength = users*7).reshape(users, 7)
+        summary = {"names":[self.authors[authorId] for authorId in keep], "commits":commits[keep],
+            "additions":total(column("additions")), "deletions":total(column("deletions")), "weekdays":weekdays[keep],
+            "nightOwl":total(hour >= 20), "earlyBird":total(hour <= 8), "words":total(column("words")),
+            "wordCounts":[self.wordCounts[authorId] for authorId in keep],
+            "shortest":[self.shortest[authorId] for authorId in keep], "longest":[self.longest[authorId] for authorId in keep]}
+        commits = summary["commits"]
+        summary["bounds"] = np.concatenate(([0], np.cumsum(commits)))
+
+        #commit times grouped by author, in time order
+        order = np.lexsort((epoch, author))
+        summary["times"] = times = epoch[order]
+        user = np.repeat(np.arange(len(keep)), commits)
+        #intervals between consecutive commits of the same user
+        within = user[1:] == user[:-1]
+        intervals = np.diff(times)[within]
+        user = user[1:][within]
+        count = np.maximum(commits - 1, 1)
+        mean = np.bincount(user, weights = intervals, minlength = len(keep))/count
+        deviation = np.sqrt(np.bincount(user, weights = (intervals - mean[user])**2, minlength = len(keep))/count)
+        eligible = (commits > 2) & (mean > 0)
+        summary["intervalMean"] = np.where(commits > 2, mean, np.nan)
+        summary["intervalVariation"] = np.where(eligible, deviation/np.where(eligible, mean, 1)*100, np.nan)
+        return summary
+
+    def summarize(self, rows = None, summary = None):
+        #Build the per user lists the reports read, over every commit or only the given rows, or from their already
+        #computed summaryArrays: [additions, deletions, commits, word frequencies, commits per weekday, sorted commit
+        #times, night owl, early bird, shortest message, longest message, words written]
+        #Word frequencies and shortest/longest messages are only kept per author, they always cover every commit
+        summary = self.summaryArrays(rows) if summary is None else summary
+        bounds = summary["bounds"]
+        users = {}
+        for i, name in enumerate(summary["names"]):
+            users[name] = [int(summary["additions"][i]), int(summary["deletions"][i]), int(summary["commits"][i]),
+                summary["wordCounts"][i], summary["weekdays"][i].tolist(), summary["times"][bounds[i]:bounds[i+1]].tolist(),
+                int(summary["nightOwl"][i]), int(summary["earlyBird"][i]), summary["shortest"][i], summary["longest"][i],
+                int(summary["words"][i])]
+        return users
+
+    def breakdown(self, groups):
+        #Per group and author [additions, deletions, commits, commits per weekday], in group then author order.
+        #groups maps each repository id to a group id, e.g. itself for per repository totals or its owner's
+        users = len(self.authors)
+        size = (max(groups) + 1 if groups else 0)*users
+        key = np.asarray(groups, np.int64)[self.column("repo")]*users + self.column("author")
+        commits = np.bincount(key, minlength = size)
+        additions = np.bincount(key, weights = self.column("additions"), minlength = size).astype(np.int64)
+        deletions = np.bincount(key, weights = self.column("deletions"), minlength = size).astype(np.int64)
+        weekdays = np.bincount(key*7 + self.column("weekday"), minlength = size*7).reshape(size, 7)
+        totals = {}
+        for cell in np.flatnonzero(commits):
+            group, authorId = divmod(int(cell), users)
+            totals[group, self.authors[authorId]] = [int(additions[cell]), int(deletions[cell]), int(commits[cell]), weekdays[cell].tolist()]
+        return totals
+
+class commitExport:
+    #Writes one CSV row per commit, gzip compressed when the path ends in .gz. Rows go out as they are written,
+    #so exporting holds nothing in memory whatever the size of the history
+    fields = ["Repository", "Oid", "Author", "Epoch", "Additions", "Deletions"]
+
+    def __init__(self, path):
+        self.output = gzip.open(path, 'wt') if path.endswith(".gz") else open(path, 'w')
+        self.writer = csv.writer(self.output)
+        self.writer.writerow(self.fields)
+
+    def write(self, repository, oid, author, epoch, additions, deletions):
+        self.writer.writerow([repository, oid, author, int(epoch), additions, deletions])
+
+    def writeTable(self, table, start = 0):
+        #Write the rows of a commitTable from start on
+        repositories, authors = table.repositories, table.authors
+        for start in range(start, len(table), 10000):
+            columns = [table.column(name)[start:start + 10000].tolist() for name in ("repo", "oid", "author", "epoch", "additions", "deletions")]
+            for repo, oid, author, epoch, additions, deletions in zip(*columns):
+                self.write(repositories[repo], oid.decode(), authors[author], epoch, additions, deletions)
+
+    def close(self):
+        self.output.close()
+
+class commitCache:
+    #SQLite store of fetched commits keyed by owner/repo/branch. Commits are immutable, so rows are only ever
+    #appended, and later runs page each branch only until a whole page of it is already cached.
+    #A branch only stores the commits of its own, where its history joins one already cached under another branch
+    #of the repository the join is recorded instead, and the rest of the history replayed from that branch
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS commits (owner TEXT, repo TEXT, branch TEXT, oid TEXT,
+                run INTEGER, message TEXT, additions INTEGER, deletions INTEGER, name TEXT, date TEXT,
+                PRIMARY KEY (owner, repo, branch, oid))""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS heads (owner TEXT, repo TEXT, branch TEXT,
+                oid TEXT, date TEXT, run INTEGER, PRIMARY KEY (owner, repo, branch))""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS defaults (owner TEXT, repo TEXT, branch TEXT,
+                PRIMARY KEY (owner, repo))""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS joins (owner TEXT, repo TEXT, branch TEXT, run INTEGER,
+                oid TEXT, target TEXT, PRIMARY KEY (owner, repo, branch, run))""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS commitsByOid ON commits (owner, repo, oid)")
+
+    def head(self, owner, repo, branch):
+        #Returns (oid, date, run) of the newest cached commit, or None if the branch was never cached
+        with self.lock:
+            return self.connection.execute("SELECT oid, date, run FROM heads WHERE owner = ? AND repo = ? AND branch = ?",
+                (owner, repo, branch)).fetchone()
+
+    def store(self, owner, repo, branch, run, commits):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO commits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(owner, repo, branch, commit["oid"], run, commit["message"], commit["additions"], commit["deletions"],
+                commit["author"]["name"], commit["author"]["date"]) for commit in commits])
+
+    def cachedBranches(self, owner, repo, branch, oids):
+        #Returns oid -> branch for the oids already cached under any branch of owner/repo, branch itself if among them
+        with self.lock:
+            rows = self.connection.execute("""SELECT oid, branch FROM commits WHERE owner = ? AND repo = ? AND oid IN (%s)
+                ORDER BY branch = ?""" % ", ".join("?"*len(oids)), [owner, repo] + list(oids) + [branch]).fetchall() if oids else []
+        return dict(rows)
+
+    def setJoin(self, owner, repo, branch, run, oid, target):
+        #The history of branch fetched in run continues with that of target from commit oid on
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO joins VALUES (?, ?, ?, ?, ?, ?)", (owner, repo, branch, run, oid, target))
+
+    def setHead(self, owner, repo, branch, run, commit):
+        #Only called once a fetch ran to completion, an interrupted run is simply fetched again
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO heads VALUES (?, ?, ?, ?, ?, ?)",
+                (owner, repo, branch, commit["oid"], commit["author"]["date"], run))
+
+    def setDefault(self, owner, repo, branch):
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO defaults VALUES (?, ?, ?)", (owner, repo, branch))
+
+    def branches(self, owner, repo):
+        #Returns (default branch, cached branches) of owner/repo, so branches can be selected offline
+        with self.lock:
+            default = self.connection.execute("SELECT branch FROM defaults WHERE owner = ? AND repo = ?", (owner, repo)).fetchone()
+            names = self.connection.execute("SELECT branch FROM heads WHERE owner = ? AND repo = ? ORDER BY rowid", (owner, repo)).fetchall()
+        return default[0] if default else None, [name for name, in names]
+
+    def history(self, owner, repo, branch, start = None, replaying = ()):
+        #Replay cached commits newest first, in the same order and shape the API returned them, following each run's
+        #join into the branch its history continues on. start skips ahead to that commit, replaying holds the
+        #branches already being replayed further up, whose history mutual joins would otherwise go round in circles
+        replaying += (branch,)
+        with self.lock:
+            runs = self.connection.execute("""SELECT run FROM commits WHERE owner = ? AND repo = ? AND branch = ?
+                UNION SELECT run FROM joins WHERE owner = ? AND repo = ? AND branch = ? ORDER BY run DESC""",
+                (owner, repo, branch)*2).fetchall()
+        for run, in runs:
+            with self.lock:
+                cursor = self.connection.execute("""SELECT oid, message, additions, deletions, name, date FROM commits
+                    WHERE owner = ? AND repo = ? AND branch = ? AND run = ? ORDER BY rowid""", (owner, repo, branch, run))
+            while True:
+                #read a page at a time rather than the whole branch
+                with self.lock:
+                    rows = cursor.fetchmany(100)
+                if not rows:
+                    break
+                for oid, message, additions, deletions, name, date in rows:
+                    if oid == start:
+                        start = None
+                    if start is None:
+                        yield {"node":{"oid":oid, "message":message, "additions":additions, "deletions":deletions,
+                            "author":{"name":name, "date":date}}}
+            with self.lock:
+                join = self.connection.execute("SELECT oid, target FROM joins WHERE owner = ? AND repo = ? AND branch = ? AND run = ?",
+                    (owner, repo, branch, run)).fetchone()
+            if join and start is None and join[1] not in replaying:
+                yield from self.history(owner, repo, join[1], join[0], replaying)
+
+@functools.lru_cache(maxsize = 1 << 16)
+def parseHour(hour):
+    #(epoch, weekday) of the start of a "YYYY-MM-DDTHH" hour in local time. Commits cluster into far fewer hours
+    #than there are commits, so building a datetime for each of them is avoided
+    start = datetime.datetime(int(hour[0:4]), int(hour[5:7]), int(hour[8:10]), int(hour[11:13]))
+    return start.timestamp(), start.weekday()
+
+def ingestCommit(table, commit, repository, startTime, endTime):
+    #parse data from a single commit of repository and append it to table if it was made in [startTime, endTime).
+    #Returns the outcome as the name of the --profile counter it goes to
+    try:
+
+        commit = commit['node']
+        if commit["oid"] in table:#already counted through another repository or branch
+            return "commitsDuplicate"
+
+        date = commit["author"]["date"]#ISO 8601, YYYY-MM-DDTHH:MM:SS followed by the offset
+        hourEpoch, weekdayCheck = parseHour(date[:13])#weekday as an int 0=monday
+        sinceEpoch = hourEpoch + int(date[14:16])*60
+        if not (startTime <= sinceEpoch < endTime):
+            return "commitsOutsideWindow"
+
+        author = commit["author"]["name"]
+        commitMessage = commit["message"]
+        additions = commit["additions"]
+        deletions = commit["deletions"]
+    except (AttributeError, TypeError):#null fields, like an author without a date
+        return "commitsMalformed"
+
+    table.append(repository, commit["oid"], author, sinceEpoch, additions, deletions, weekdayCheck, int(date[11:13]), commitMessage)
+    return "commitsIngested"
+
+class runProfiler:
+    #Collects what --profile reports: phase timings, every request, pages and commits per repository and
+    #counters from ingest. Does nothing unless enabled, so the hot paths can call it unconditionally
+    phaseNames = ("getStats", "summarize", "mergePartials", "exportCommits", "emitPartial", "makeWordCloud", "graphStats",
+        "makeCSV", "makeRepoReports", "grantAwards")
+    hookNames = ("cProfile", "tracemalloc")
+
+    def __init__(self, enabled = False, hooks = None):
+        self.enabled = enabled
+        self.hooks = hooks or {}#phase name -> "cProfile" or "tracemalloc"
+        self.lock = threading.Lock()
+        self.phases = []
+        self.requests = []
+        self.repositories = {}
+        self.counters = collections.Counter()
+        self.profiling = False#a phase is running under cProfile, phases nested in it are covered by its profile
+
+    @contextlib.contextmanager
+    def phase(self, name, path = None):
+        #Time a phase, running it under cProfile or tracemalloc if a hook was asked for it.
+        #cProfile only sees the calling thread, path is where its stats are dumped. A phase nested in one already
+        #profiled or traced leaves starting and stopping to the outer phase
+        if not self.enabled:
+            yield
+            return
+        hook = self.hooks.get(name)
+        profiler = None
+        tracing = False
+        if hook == "cProfile" and not self.profiling:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            self.profiling = True
+        elif hook == "tracemalloc" and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            tracing = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = {"phase":name, "seconds":time.perf_counter() - start}
+            if profiler:
+                profiler.disable()
+                self.profiling = False
+                record["cProfile"] = (path or "profile") + "." + name + ".prof"
+                profiler.dump_stats(record["cProfile"])
+            elif hook == "tracemalloc" and tracemalloc.is_tracing():
+                #the peak of a nested phase would be the outer phase's so far, only its live allocations are its own
+                if tracing:
+                    record["tracedPeakBytes"] = tracemalloc.get_traced_memory()[1]
+                record["topAllocations"] = [str(stat) for stat in tracemalloc.take_snapshot().statistics("lineno")[:10]]
+                if tracing:
+                    tracemalloc.stop()
+            self.phases.append(record)
+
+    def request(self, label, status, seconds, size, decodeSeconds):
+        if self.enabled:
+            with self.lock:
+                self.requests.append({"label":label, "status":status, "seconds":seconds, "bytes":size, "decodeSeconds":decodeSeconds})
+
+    def page(self, repository, commits):
+        if self.enabled:
+            with self.lock:
+                stats = self.repositories.setdefault(repository, {"pages":0, "commits":0})
+                stats["pages"] += 1
+                stats["commits"] += commits
+
+    def count(self, name, amount = 1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += amount
+
+    def write(self, path, args):
+        report = {"arguments":{name:value for name, value in vars(args).items() if name != "apiKey"},
+            "phases":self.phases, "counters":dict(self.counters), "repositories":self.repositories, "requests":self.requests,
+            "requestTotals":{"requests":len(self.requests), "seconds":sum(request["seconds"] for request in self.requests),
+                "bytes":sum(request["bytes"] for request in self.requests)}}
+        with open(path, 'w') as output:
+            json.dump(report, output, indent = 2, default = str)
+
+class requestScheduler:
+    #Sends GraphQL requests through one session for every worker, so they share one rate limit budget.
+    #Requests are paced once the budget runs low, and transient failures are retried with jittered backoff
+    reserve = 100#points left before requests start being spread over the time until reset
+
+    def __init__(self, session, retries = 5, profiler = None):
+        self.session = session
+        self.profiler = profiler or runProfiler()
+        self.retries = retries
+        self.lock = threading.Lock()
+        self.remaining = None
+        self.resetAt = None
+        self.nextRequest = 0#no request may be sent before this time, pushed back by pacing and secondary rate limits
+        self.costs = {}#points the last request of each query cost, batched lookups cost several
+
+    def wait(self, cost):
+        #Claim the next slot under the shared budget for a request of cost points, sleeping until it comes up.
+        #The points are taken off the budget right away, the next response corrects it
+        with self.lock:
+            now = time.time()
+            start = max(now, self.nextRequest)
+            if self.remaining is not None and self.resetAt and self.resetAt > now:
+                if self.remaining < cost:
+                    start = max(start, self.resetAt)
+                elif self.remaining - cost < self.reserve:
+                    self.nextRequest = start + (self.resetAt - now)*cost/self.remaining
+                self.remaining -= cost
+        if start > now:
+            time.sleep(start - now)
+
+    def pause(self, seconds):
+        #Hold every worker back, used when GitHub says how long to wait
+        with self.lock:
+            self.nextRequest = max(self.nextRequest, time.time() + seconds)
+
+    def backoff(self, attempt):
+        #Full jitter exponential backoff, keeps retrying workers from firing in lock step
+        time.sleep(random.uniform(0, min(60, 2**attempt)))
+
+    def update(self, response, data, query):
+        with self.lock:
+            if "X-RateLimit-Remaining" in response.headers:
+                self.remaining = int(response.headers["X-RateLimit-Remaining"])
+                self.resetAt = int(response.headers["X-RateLimit-Reset"])
+            if data and data.get("rateLimit"):
+                rateLimit = data["rateLimit"]
+                self.remaining = rateLimit["remaining"]
+                self.resetAt = datetime.datetime.fromisoformat(rateLimit["resetAt"].replace("Z", "+00:00")).timestamp()
+                if rateLimit.get("cost") is not None:
+                    self.costs[query] = rateLimit["cost"]
+
+    def post(self, url, query, variables, label = None, cost = 1):
+        #Returns the data of the response, or None once the request can't be completed.
+        #label names what the request was for in the --profile report, cost estimates the points the request
+        #takes from the budget until a response to the same query reports what it actually cost
+        for attempt in range(self.retries + 1):
+            self.wait(self.costs.get(query, cost))
+            start = time.perf_counter()
+            try:
+                response = self.session.post(url,json={'query':query, 'variables':variables})
+            except requests.exceptions.RequestException as error:
+                self.profiler.request(label, None, time.perf_counter() - start, 0, 0)
+                failure = str(error)
+                self.backoff(attempt)
+                continue
+            seconds = time.perf_counter() - start
+            if response.status_code != 200:
+                self.profiler.request(label, response.status_code, seconds, len(response.content), 0)
+            if response.status_code in (403, 429):
+                #primary and secondary rate limits, GitHub sends Retry-After or the reset time of the budget
+                failure = "rate limited"
+                if "Retry-After" in response.headers:
+                    self.pause(int(response.headers["Retry-After"]))
+                elif response.headers.get("X-RateLimit-Remaining") == "0":
+                    self.pause(int(response.headers["X-RateLimit-Reset"]) - time.time())
+                else:
+                    self.backoff(attempt)
+                continue
+            if response.status_code >= 500:
+                failure = "status " + str(response.status_code)
+                self.backoff(attempt)
+                continue
+            if response.status_code != 200:
+                print("Request failed with status", response.status_code)
+                return None
+            start = time.perf_counter()
+            try:
+                body = json.loads(response.text)
+            except ValueError:
+                body = None
+            self.profiler.request(label, response.status_code, seconds, len(response.content), time.perf_counter() - start)
+            if body is None:
+                failure = "invalid response body"
+                self.backoff(attempt)
+                continue
+            data = body.get("data")
+            self.update(response, data, query)
+            errors = body.get("errors") or []
+            if any(error.get("type") == "RATE_LIMITED" for error in errors):
+                failure = "rate limited"
+                if self.remaining == 0 and self.resetAt:
+                    self.pause(self.resetAt - time.time())
+                else:
+                    self.backoff(attempt)
+                continue
+            if data is None:
+                #the query itself was rejected, retrying won't help
+                print("Request failed:", "; ".join(error.get("message", "") for error in errors))
+                return None
+            #errors left over are for parts of the query, like lookups of repositories that don't exist
+            return data
+        print("Request failed after", self.retries + 1, "attempts:", failure)
+        return None
+
+#Awards grantAwards reports, by name, each scoring every user from the arrays of commitTable.summaryArrays
+awardMetrics = {}
+
+def awardMetric(name, best = "max", message = None):
+    #Register an award. The metric returns per user scores, NaN for users that don't qualify, or a tuple of the scores
+    #followed by other per user values reported along with them. The first user with the best score wins.
+    #message is how grantAwards announces the winner, a str.format template or a function, both given (user, score, ...)
+    if message is None:
+        message = "{0} wins " + name + " with a score of {1}"
+    def register(metric):
+        awardMetrics[name] = (metric, best, message)
+        return metric
+    return register
+
+def announceMessage(title):
+    #Message of the longest/shortest message awards, the winning message wrapped below the announcement
+    wrapper = textwrap.TextWrapper(initial_indent='\t"',subsequent_indent = '\t', width=70)
+    return lambda user, length, message: str(user) + " turned in the " + title + ":\n" + wrapper.fill(message) + '"'
+
+@awardMetric("weekendWarrior", message = "{0} is the WEEKEND WARRIOR with {1} commits logged on weekends")
+def weekendCommits(summary):
+    return summary["weekdays"][:, 5] + summary["weekdays"][:, 6]
+
+@awardMetric("committedCommitter", message = lambda user, count, date:
+    "%s is the COMMITTED COMMITTER with %s commits logged since joining at %s" % (user, count, datetime.datetime.fromtimestamp(date)))
+def commitCount(summary):
+    #reported with the time of the user's second commit, or their only one
+    bounds = summary["bounds"]
+    return summary["commits"], summary["times"][np.minimum(bounds[:-1] + 1, bounds[1:] - 1)]
+
+@awardMetric("heavyHitter", message = lambda user, additions, commits:
+    "Watch out for this HEAVY HITTER... %s has averaged %d additions over %s commits" % (user, additions, commits))
+def additionsPerCommit(summary):
+    return summary["additions"]/summary["commits"], summary["commits"]
+
+#interval awards need a user with more than two commits, spread out in time for the variation ones
+@awardMetric("sporadic", message = lambda user, variation:
+    "%s is the most SPORADIC COMMITTER with a commit interval variation coefficient of %d%%" % (user, variation))
+def mostVariedInterval(summary):
+    return summary["intervalVariation"]
+
+@awardMetric("consistent", "min", lambda user, variation:
+    "%s is the most CONSISTENT COMMITTER with a commit interval variation coefficient of only  %d%%" % (user, variation))
+def leastVariedInterval(summary):
+    return summary["intervalVariation"]
+
+@awardMetric("tortise", message = lambda user, interval:
+    "%s is the TORTISE with a mean commit interval of %d hours" % (user, interval/60/60))
+def longestInterval(summary):
+    return summary["intervalMean"]
+
+@awardMetric("hare", "min", lambda user, interval:
+    "%s is the HARE with a mean commit interval of only %d hours" % (user, interval/60/60))
+def shortestInterval(summary):
+    return summary["intervalMean"]
+
+@awardMetric("verbose", message = "{0} is the most VERBOSE COMMITTER, averaging {1} words per commit")
+def wordsPerCommit(summary):
+    return summary["words"]/summary["commits"]
+
+@awardMetric("earlyBird", message = "{0} is an EARLY BIRD with the most early morning commits")
+def earlyCommits(summary):
+    return summary["earlyBird"]
+
+@awardMetric("nightOwl", message = "{0} is the NIGHT OWL with the most late night commits")
+def lateCommits(summary):
+    return summary["nightOwl"]
+
+@awardMetric("longestMessage", message = announceMessage("LONGEST COMMIT MESSAGE"))
+def longestMessage(summary):
+    return np.array([len(message) for message in summary["longest"]]), summary["longest"]
+
+@awardMetric("shortestMessage", "min", announceMessage("SHORTEST COMMIT MESSAGE"))
+def shortestMessage(summary):
+    return np.array([len(message) for message in summary["shortest"]]), summary["shortest"]
+
 class gitStatistics:
     def __init__(self,args):
-        #Initialize argument parser
-        self.argParser = self.__initArgParser()
-        self.args = self.argParser.parse_args(args)
-        if not self.args.branch:
-            self.args.branch = "master"
+        #Initialize argument parser, a leading "merge" combines partial aggregates instead of fetching
+        self.merging = len(args) > 0 and args[0] == "merge"
+        if self.merging:
+            self.argParser = self.__initMergeParser()
+            self.args = self.argParser.parse_args(args[1:])
+        else:
+            self.argParser = self.__initArgParser()
+            self.args = self.argParser.parse_args(args)
+        if not self.args.workers:
+            self.args.workers = 1
+        else:
+            self.args.workers = int(self.args.workers)
+        if self.args.maxWords:
+            self.args.maxWords = int(self.args.maxWords)
+
+        #Commits are kept per repository and author in self.commits, self.users is the per user view reports read
+        self.users = {}
+        self.summary = None#the arrays self.users is built from, see commitTable.summaryArrays
+        self.export = None#per commit CSV rows, only open while ingesting
+        self.commits = commitTable(self.args.maxWords)
+        #--profilePhases looks like getStats:cProfile,makeWordCloud:tracemalloc
+        hooks = {}
+        for hook in self.args.profilePhases.split(",") if self.args.profilePhases else []:
+            phase, _, name = hook.partition(":")
+            if phase not in runProfiler.phaseNames or name not in runProfiler.hookNames:
+                self.argParser.error("--profilePhases entry %r is not phase:hook with a phase of %s and a hook of %s"
+                    % (hook, ", ".join(runProfiler.phaseNames), " or ".join(runProfiler.hookNames)))
+            hooks[phase] = name
+        self.profiler = runProfiler(bool(self.args.profile), hooks)
+        if self.merging:
+            return
+
+        #--branch holds branch names or globs, without it the default branch is read, as checked out with --local
+        self.branches = self.args.branch.split(",") if self.args.branch else []
+        if self.args.local and not self.branches:
+            self.branches = ["HEAD"]
+        #branch names are only looked up when globs or the default branch have to be resolved
+        self.resolving = not self.branches or any(set(branch) & set("*?[") for branch in self.branches)
         if not self.args.startTime:
             self.args.startTime = 0
         else:
@@ -63,78 +1011,125 @@ class gitStatistics:
             self.args.endTime = datetime.datetime.utcnow().timestamp()
         else:
             self.args.endTime = int(self.args.endTime)
+        if not self.args.batchSize:
+            self.args.batchSize = 1
+        else:
+            self.args.batchSize = int(self.args.batchSize)
+        if self.args.offline and not self.args.cache:
+            self.argParser.error("--offline requires --cache")
+        self.prefetcher = None#thread pool for requesting next pages early, only exists while fetching
+        self.cache = None
+        if self.args.cache:
+            self.cache = commitCache(self.args.cache)
         #Create a session to set default call Header information
         self.session = requests.session()
         self.session.headers = {"Authorization":"token " + self.args.apiKey}
         self.session.verify = False
+        #Pool enough connections for every worker to keep its own query, and the prefetch of its next page, in flight
+        adapter = requests.adapters.HTTPAdapter(pool_connections = self.args.workers, pool_maxsize = self.args.workers*2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        if not self.args.retries:
+            self.args.retries = 5
+        else:
+            self.args.retries = int(self.args.retries)
+        self.scheduler = requestScheduler(self.session, self.args.retries, self.profiler)
         #Set a default base URL for api calls
-        if self.args.hostname:
+        if self.args.hostname and "://" in self.args.hostname:#hostname already names its scheme, e.g. a local stand in
+            self.url = self.args.hostname +'/api/graphql'
+        elif self.args.hostname:
             self.url = 'https://'+ self.args.hostname +'/api/graphql'
         else:
             self.url = 'https://api.github.com/graphql'
 
-        #TODO: Change from user focused structure to Repository focused structure to enable
-        #breakout reports based on individual repositories
-        self.users = {}
-
     #Define arguments which the user may be prompted for
     @staticmethod
     def __initArgParser():
         argParser = argparse.ArgumentParser(description='Gathers statistics on activity in targetted GitHub Repositories, default selection are repositories within current directory')
         argParser.add_argument("apiKey", help = 'Github api key')
         argParser.add_argument("owners", help = 'Comma separated Owner(s) of targeted Repos')
-        argParser.add_argument("--branch","--b", help = 'User defined target branch, default is master')
-        argParser.add_argument("--hostname", "--hn", help = 'https://<user specified hostname>/api/graphql - use for enterprise')
+        argParser.add_argument("--branch","--b", help = 'Comma separated target branch(es), globs such as release/* are matched against every branch, default is the default branch')
+        argParser.add_argument("--hostname", "--hn", help = 'https://<user specified hostname>/api/graphql - use for enterprise, a scheme such as http:// may be included')
         argParser.add_argument("--repos","--r", help = 'Additional Repos to analyze - Comma separated repo(s)')
         argParser.add_argument("--excludeRepos", "--er",  help = 'Comma separated repo(s) to exclude')
         argParser.add_argument("--addr", help = 'Address of a folder containing repos or csv containing repo names')
+        gitStatistics.__addReportArguments(argParser)
+        argParser.add_argument("--startTime","--st", help ='Earliest commit time since epoch to accept (seconds)')
+        argParser.add_argument("--endTime","--et", help = 'Latest commit time since epoch to accept (seconds)')
+        argParser.add_argument("--batchSize","--bs", help = 'Number of owner/repo combinations to look up per GraphQL request, default is 1')
+        argParser.add_argument("--retries", help = 'Times a failed or rate limited request is retried before its repository is skipped, default is 5')
+        argParser.add_argument("--cache", help = 'SQLite file to keep fetched commits in, later runs only fetch newer commits')
+        argParser.add_argument("--local", help = 'Read statistics from the cloned repositories with git log instead of the GitHub api', action = 'store_true')
+        argParser.add_argument("--offline", help = 'Only report on commits already stored in --cache, without querying GitHub', action = 'store_true')
+        return argParser
+
+    @staticmethod
+    def __initMergeParser():
+        argParser = argparse.ArgumentParser(prog = 'gitStatistics.py merge', description='Combines partial aggregates written with --emitPartial and reports on them as a single run')
+        argParser.add_argument("partials", nargs = '+', help = 'Partial aggregate files, merged in the order given')
+        gitStatistics.__addReportArguments(argParser)
+        return argParser
+
+    #Arguments shared by regular runs and merges
+    @staticmethod
+    def __addReportArguments(argParser):
         argParser.add_argument("--wordCloud","--wc", help = 'Generates word clouds from commit messages', action = 'store_true')
+        argParser.add_argument("--maxWords","--mw", help = 'Most frequent words kept per user for word clouds, default keeps every word and draws 200')
         argParser.add_argument("--graphStats","--gs", help = 'Displays Simple Graphs of data', action = 'store_true')
         argParser.add_argument("--csv", help = 'Stores recorded data as a CSV', action = 'store_true')
+        argParser.add_argument("--compactCSV","--cc", help = 'With --csv, writes First Commit and Last Commit epoch columns in place of the list of Commit Times', action = 'store_true')
+        argParser.add_argument("--repoReports","--rr", help = 'Stores per repository and per owner data as CSVs', action = 'store_true')
+        argParser.add_argument("--commitExport","--ce", help = 'Writes one row per commit, with its repository, oid, author, epoch, additions and deletions, to the given .csv, .csv.gz or .npz file')
         argParser.add_argument("--awards","--aw", help = 'Prints awards/titles for users based on their statistics', action = 'store_true')
-        argParser.add_argument("--startTime","--st", help ='Earliest commit time since epoch to accept (seconds)')
-        argParser.add_argument("--endTime","--et", help = 'Latest commit time since epoch to accept (seconds)')
-        return argParser
+        argParser.add_argument("--emitPartial","--ep", help = 'Writes a partial aggregate to the given file, to be combined later with merge')
+        argParser.add_argument("--profile", help = 'Writes a JSON run report with phase timings, requests, pages and commits per repository and ingest counters to the given file')
+        argParser.add_argument("--profilePhases", help = 'Comma separated phase:cProfile or phase:tracemalloc pairs, running those phases under the profiler with --profile')
+        argParser.add_argument("--workers","--w", help = 'Number of repository queries to keep in flight, or word clouds to render, at once, default is 1')
 
     def makeWordCloud(self):
+        #Only users with words left after removing stopwords get a cloud
+        users = [user for user in self.users if len(self.users.get(user)[3]) != 0]
+        if not users:
+            return
+        #Rasterize every cloud first, in worker processes when there are several workers
+        frequencies = [self.users.get(user)[3] for user in users]
+        if self.args.workers > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers = self.args.workers) as executor:
+                images = list(executor.map(renderWordCloud, frequencies, itertools.repeat(self.args.maxWords)))
+        else:
+            images = [renderWordCloud(words, self.args.maxWords) for words in frequencies]
+
         #Prepare for creating subplot, calculate rows/cols
-        plots = len(self.users)
+        plots = len(users)
         cols = int(np.ceil(np.sqrt(plots)))
         rows = int(np.ceil(plots/cols))
-        i = 1 #index of current plot, tells plt.subplot() where to place the wordCloud
+        plt = pyplot()
+        from matplotlib.backends.backend_pdf import PdfPages
         with PdfPages('wordClouds.pdf') as pdf:
-            plt.figure(figsize = (cols*5,rows*5), facecolor = '#d5d8de')
-            #create a wordcloud for each recorded user
-            for user in self.users:
-                words = self.users.get(user)[3]#get saved commit messages
-                if len(words) == 0:
-                    continue
-                words = words.lower()#standardize case, TEST == test == TesT
-
-                wordcloud = WordCloud(width = 800, height = 800,
-                background_color ='#d5d8de',
-                stopwords = set(STOPWORDS), #filter out insignificant words
-                min_font_size = 1,
-                colormap='Blues').generate(words)
-
-                #add wordcloud to subplot
-                ax = plt.subplot(int(rows),int(cols),i).set_title(user, fontweight = 'bold')
-                plt.imshow(wordcloud)
-                plt.axis("off")
-                plt.tight_layout(pad = 1)
-
-                i+=1 #iterate    
-            pdf.savefig()
-            for r in range(rows):
-                for c in range(cols):
-                    pdf.savefig(bbox_inches=Bbox.from_bounds(c*5, (rows-r-1)*5, 5, 5))
-                    i-=1
-                    if i == 1:
-                        return
-
+            #first page holds every cloud
+            figure = plt.figure(figsize = (cols*5,rows*5), facecolor = '#d5d8de')
+            for i, (user, image) in enumerate(zip(users, images)):
+                ax = figure.add_subplot(rows, cols, i+1)
+                ax.set_title(user, fontweight = 'bold')
+                ax.imshow(image)
+                ax.axis("off")
+            figure.tight_layout(pad = 1)
+            pdf.savefig(figure)
+            plt.close(figure)
+            #followed by a page per user, drawn from the finished image rather than cropping the whole grid again
+            for user, image in zip(users, images):
+                figure = plt.figure(figsize = (5,5), facecolor = '#d5d8de')
+                ax = figure.add_subplot(1, 1, 1)
+                ax.set_title(user, fontweight = 'bold')
+                ax.imshow(image)
+                ax.axis("off")
+                figure.tight_layout(pad = 1)
+                pdf.savefig(figure)
+                plt.close(figure)
 
     def makeCSV(self):
-        fields = ["User Name", "Additions", "Deletions", "Commits", "Commits per Weekday", "Commit Times"]
+        fields = ["User Name", "Additions", "Deletions", "Commits", "Commits per Weekday"]
+        fields += ["First Commit", "Last Commit"] if self.args.compactCSV else ["Commit Times"]
         with open('gitStatistics.csv', 'w') as csvOutput:
             outputWriter = csv.writer(csvOutput)
             outputWriter.writerow(fields)
@@ -146,173 +1141,53 @@ class gitStatistics:
                 row+=[userStats[1]]#Deletions
                 row+=[userStats[2]]#Commits
                 row+=[userStats[4]]#Commits Per Weekday
-                row+=[userStats[5]]#Commit Times
+                if self.args.compactCSV:
+                    row+=[int(userStats[5][0])]#First Commit, epoch seconds, every commit is in the per commit export
+                    row+=[int(userStats[5][-1])]#Last Commit
+                else:
+                    row+=[userStats[5]]#Commit Times
                 outputWriter.writerow(row)
 
-    def grantAwards(self):
-        committedUser = None
-        committedScore = None
-        committedDate = None
-        weekendUser = None
-        weekendScore = None
-        additionUser = None
-        additionScore = None
-        additionCommits = None
-        sporadicUser = None
-        sporadicScore = None
-        consistentUser = None
-        consistentScore = None
-        hareUser = None
-        hareScore = None
-        tortiseUser = None
-        tortiseScore = None
-        verboseUser = None
-        verboseScore = None
-        earlyUser = None
-        earlyScore = None
-        lateUser = None
-        lateScore = None
-        shortestCommitUser = None
-        shortestCommit = None
-        longestCommitUser = None
-        longestCommit = None
-        for user in self.users:
-            userStats = self.users.get(user)
-            #Weekend Warrior
-            userScore = userStats[4][5] + userStats[4][6]
-            if weekendUser is not None:
-                if userScore > weekendScore:
-                    weekendUser = user
-                    weekendScore = userScore
-            else:
-                weekendUser = user
-                weekendScore = userScore
-            #Committed Committer
-            userScore =  userStats[2]
-            if committedUser is not None:
-                if userScore > committedScore:
-                    committedUser = user
-                    committedScore = userScore
-                    committedDate = userStats[5][1]
-            else:
-                committedUser = user
-                committedScore = userScore
-                committedDate = userStats[5][1]
-            #Heavy Hitter
-            userScore = userStats[0] / userStats[2]
-            if additionUser is not None:
-                if userScore > additionScore:
-                    additionUser = user
-                    additionScore = userScore
-                    additionCommits = userStats[2]
-            else:
-                additionUser = user
-                additionScore = userScore
-                additionCommits = userStats[2]
-            #Sporadic/Consistent/hare Committer
-            if userStats[2] > 2:
-                try:
-                    userTimeBetweenCommits = []
-                    mean = 0
-                    for i in range(userStats[2]-1):
-                        curTime = userStats[5][i]
-                        nextTime = userStats[5][i+1]
-                        userTimeBetweenCommits += [nextTime-curTime]
-                        mean += nextTime-curTime
-                    mean = mean/len(userTimeBetweenCommits)
-                    userScore = np.std(userTimeBetweenCommits)/mean*100
-                    if sporadicUser is not None:
-                        if userScore > sporadicScore:
-                            sporadicUser = user
-                            sporadicScore = userScore
-                    else:
-                        sporadicUser = user
-                        sporadicScore = userScore
-                    if consistentUser is not None:
-                        if userScore < consistentScore:
-                            consistentUser = user
-                            consistentScore = userScore
-                    else:
-                        consistentUser = user
-                        consistentScore = userScore
-                    if hareUser is not None:
-                        if mean < hareScore:
-                            hareUser = user
-                            hareScore = mean
-                    else:
-                        hareUser = user
-                        hareScore = mean
-                    if tortiseUser is not None:
-                        if mean > tortiseScore:
-                            tortiseUser = user
-                            tortiseScore = mean
-                    else:
-                        tortiseUser = user
-                        tortiseScore = mean
-                except ZeroDivisionError:
-                    pass
-            #Verbose Committer
-            userScore = len(userStats[3].split(" "))/userStats[2]
-            if verboseUser is not None:
-                if userScore > verboseScore:
-                    verboseUser = user
-                    verboseScore = userScore
-            else:
-                verboseUser = user
-                verboseScore = userScore
-            #Night Owl
-            userScore = userStats[6]
-            if lateUser is not None:
-                if userScore > lateScore:
-                    lateUser = user
-                    lateScore = userScore
-            else:
-                lateUser = user
-                lateScore = userScore
-            #Early Bird
-            userScore = userStats[7]
-            if earlyUser is not None:
-                if userScore > earlyScore:
-                    earlyUser = user
-                    earlyScore = userScore
-            else:
-                earlyUser = user
-                earlyScore = userScore
-            #Shortest/Longest Commits
-            userShortCommit = userStats[8]
-            userLongCommit = userStats[9]
-            if longestCommitUser is not None:
-                if len(userLongCommit)>len(longestCommit):
-                    longestCommitUser = user
-                    longestCommit = userLongCommit
-            else:
-                longestCommitUser = user
-                longestCommit = userLongCommit
-            if shortestCommitUser is not None:
-                if len(userShortCommit)<len(shortestCommit):
-                    shortestCommitUser = user
-                    shortestCommit = userShortCommit
-            else:
-                shortestCommitUser = user
-                shortestCommit = userShortCommit
-
-        print(weekendUser,"is the WEEKEND WARRIOR with",weekendScore,"commits logged on weekends")
-        print(committedUser,"is the COMMITTED COMMITTER with",committedScore,"commits logged since joining at",datetime.datetime.fromtimestamp(committedDate))
-        print("Watch out for this HEAVY HITTER...",additionUser,"has averaged",int(additionScore),"additions over",additionCommits,"commits")
-        print(sporadicUser,"is the most SPORADIC COMMITTER with a commit interval variation coefficient of",str(int(sporadicScore))+ "%")
-        print(consistentUser,"is the most CONSISTENT COMMITTER with a commit interval variation coefficient of only ",str(int(consistentScore))+"%")
-        print(tortiseUser,"is the TORTISE with a mean commit interval of",int(tortiseScore/60/60),"hours")
-        print(hareUser,"is the HARE with a mean commit interval of only",int(hareScore/60/60),"hours")
-        print(verboseUser,"is the most VERBOSE COMMITTER, averaging",verboseScore,"words per commit")
-        print(earlyUser,"is an EARLY BIRD with the most early morning commits")
-        print(lateUser,"is the NIGHT OWL with the most late night commits")
-
-        wrapper = textwrap.TextWrapper(initial_indent='\t"',subsequent_indent = '\t', width=70)
-        print(longestCommitUser,"turned in the LONGEST COMMIT MESSAGE:")
-        print(wrapper.fill(longestCommit)+'"')
-        print(shortestCommitUser,"turned in the SHORTEST COMMIT MESSAGE:")
-        print(wrapper.fill(shortestCommit)+'"')
+    def makeRepoReports(self):
+        #Per repository and per owner totals of every user, repositories are owner/repo or a directory with --local
+        repositories = self.commits.repositories
+        owners = list(dict.fromkeys(repository.rpartition("/")[0] for repository in repositories))
+        reports = [('gitStatisticsRepos.csv', ["Owner", "Repository"], list(range(len(repositories))),
+                lambda group: list(repositories[group].rpartition("/")[::2])),
+            ('gitStatisticsOwners.csv', ["Owner"], [owners.index(repository.rpartition("/")[0]) for repository in repositories],
+                lambda group: [owners[group]])]
+        for name, keys, groups, label in reports:
+            with open(name, 'w') as csvOutput:
+                outputWriter = csv.writer(csvOutput)
+                outputWriter.writerow(keys + ["User Name", "Additions", "Deletions", "Commits", "Commits per Weekday"])
+                for (group, user), userStats in self.commits.breakdown(groups).items():
+                    outputWriter.writerow(label(group) + [user] + userStats)
 
+    def scoreAwards(self, summary):
+        #Winner of every registered award among the users of summary, as returned by commitTable.summaryArrays,
+        #as award -> (user, score, ...), or all None if no user qualifies
+        awards = {}
+        for name, (metric, best, message) in awardMetrics.items():
+            values = metric(summary)
+            values = values if isinstance(values, tuple) else (values,)
+            scores = np.asarray(values[0], np.float64)
+            eligible = np.flatnonzero(~np.isnan(scores))
+            if len(eligible) == 0:
+                awards[name] = (None,)*(len(values) + 1)
+                continue
+            winner = eligible[np.argmax(scores[eligible]) if best == "max" else np.argmin(scores[eligible])]
+            awards[name] = (summary["names"][winner],) + tuple(value[winner].item() if isinstance(value[winner], np.generic)
+                else value[winner] for value in values)
+        return awards
+
+    def grantAwards(self):
+        #Announce the winner of every registered award, in registration order, skipping awards nobody qualifies for
+        awards = self.scoreAwards(self.summary)
+        for name, (metric, best, message) in awardMetrics.items():
+            award = awards[name]
+            if award[0] is None:
+                continue
+            print(message.format(*award) if isinstance(message, str) else message(*award))
 
     def graphStats(self):
         additionBar=[] 
@@ -325,6 +1200,8 @@ class gitStatistics:
             deletionBar.append(self.users.get(user)[1])
             userList.append(user)
 
+        plt = pyplot()
+        from matplotlib.backends.backend_pdf import PdfPages
         with PdfPages('gitStatGraphs.pdf') as pdf:
             #Report Additions
             plt.figure(figsize = (12,10), facecolor = '#f5f5f5')
@@ -333,6 +1210,7 @@ class gitStatistics:
             plt.ylabel("Number of Additions")
             plt.xticks(rotation = 90)#rotate names to prevent overlap if there are too many
             pdf.savefig()
+            plt.close()#release each chart once written
 
             #Report Deletions
             plt.figure(figsize = (12,10), facecolor = '#f5f5f5')
@@ -341,6 +1219,7 @@ class gitStatistics:
             plt.ylabel("Number of Deletions")
             plt.xticks(rotation = 90)
             pdf.savefig()
+            plt.close()
 
             #Report Daily Commits
             dayNames = ["Mon","Tue","Wed","Thur","Fri","Sat","Sun"]
@@ -355,8 +1234,9 @@ class gitStatistics:
             plt.title("Commits per day of Week", fontweight = 'bold')
             plt.ylabel("Number of Commits")
             pdf.savefig()
+            plt.close()
 
-    def getStats(self):
+    def getRepos(self):
         ##Compile list of target repositories
         repos = []
         #Load from address
@@ -372,13 +1252,13 @@ class gitStatistics:
                         print("Indicated CSV does not exist")
                 else:
                     print("Invalid file type")
-                    return
+                    return None
             else:
                 try:
                     repos = os.listdir(self.args.addr)
                 except FileNotFoundError:
                     print("Invalid directory address")
-                    return
+                    return None
         else:
             repos = os.listdir(os.curdir)
         if self.args.repos:
@@ -390,98 +1270,410 @@ class gitStatistics:
             for repo in self.args.excludeRepos:
                 if repo in repos:
                     repos.pop(repos.index(repo))
+        return repos
+
+    def historyWindow(self):
+        #Convert --startTime into a GraphQL since timestamp, padded by a day because commit dates are compared in
+        #local time below, where the check against the author date stays authoritative. Servers may filter on the
+        #committer date, which is no earlier than the author date so since is safe, but rebased or cherry-picked
+        #commits can be committed long after the end of the window, so until is left open
+        pad = 24*60*60
+        since = None
+        if self.args.startTime - pad > 0:
+            since = datetime.datetime.fromtimestamp(self.args.startTime - pad, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return since, None
+
+    def fetchPage(self, repo, owner, branch, cursor, since, until):
+        #One page of history after cursor, or None if there is none to be had
+        params = {"repo":repo,"owner":owner, 'branch':branch, 'cursor':cursor, 'since':since, 'until':until}
+        data = self.scheduler.post(self.url, queryBase, params, owner + "/" + repo)
+        if data is None:
+            print("Skipping the rest of", owner + "/" + repo)
+            return None
+        data = data["repository"]
+
+        if not data: #if the owner/repository combination is invalid, conitnue to next
+            return None
+
+        data = data["ref"]
+        if not data:
+            return None
+        return data["target"]["history"]
+
+    def fetchPages(self, repo, owner, branch, history = None, window = None, prefetch = True, shared = False, walked = None):
+        #Yield the history of branch of owner/repo page by page, following the history cursor.
+        #history may hold an already fetched first page, as returned by fetchBatch, window overrides
+        #the (since, until) timestamps derived from --startTime/--endTime. With prefetch the next page is
+        #requested before the current one is handed on, so it is on the network while this one is ingested.
+        #Unless shared history is wanted, paging stops at the first page made up entirely of commits already
+        #ingested or walked, as a fork, mirror or other branch has been reached where its history joins one
+        #already read. walked collects the commits of branches fetched earlier, which may not be ingested yet
+        since, until = window or self.historyWindow()
+        walked = set() if walked is None else walked
+        if history is None:
+            history = self.fetchPage(repo, owner, branch, None, since, until)
+        while history is not None:
+            self.profiler.page(owner + "/" + repo, len(history["edges"]))
+            oids = [edge["node"]["oid"] for edge in history["edges"]]
+            if not shared and oids and all(oid in walked or oid in self.commits for oid in oids):
+                self.profiler.count("pagesShared")
+                return
+            walked.update(oids)
+            if not history["pageInfo"]["hasNextPage"]:
+                yield history
+                return
+            cursor = history["pageInfo"]["endCursor"]
+            if prefetch and self.prefetcher:
+                nextPage = self.prefetcher.submit(self.fetchPage, repo, owner, branch, cursor, since, until)
+                yield history
+                history = nextPage.result()
+            else:
+                yield history
+                history = self.fetchPage(repo, owner, branch, cursor, since, until)
 
+    def fetchHistory(self, repo, owner, branch, history = None, window = None, prefetch = True, shared = False, walked = None):
+        #Yield every commit on branch of owner/repo, only the current page is held in memory
+        for page in self.fetchPages(repo, owner, branch, history, window, prefetch, shared, walked):
+            yield from page["edges"]
+
+    def resolveBranches(self, repo, owner, refs = None):
+        #Branches of owner/repo selected by --branch. refs may hold the default branch and first page of branch
+        #names from a batched lookup, otherwise they are only queried when there is something to resolve
+        if refs is None and not self.resolving:
+            return self.branches
+        if refs is None and self.args.offline:
+            default, names = self.cache.branches(owner, repo)
+            return selectBranches(self.branches, names, default)
+        params = {"repo":repo, "owner":owner, "cursor":None}
+        if refs is None:
+            data = self.scheduler.post(self.url, refsQuery, params, owner + "/" + repo)
+            if not data or not data["repository"]:
+                return []
+            refs = data["repository"]
+        default = refs["defaultBranchRef"]["name"] if refs["defaultBranchRef"] else None
+        names = [node["name"] for node in refs["refs"]["nodes"]]
+        pageInfo = refs["refs"]["pageInfo"]
+        #the default branch alone needs no branch listing
+        while self.branches and pageInfo["hasNextPage"]:
+            data = self.scheduler.post(self.url, refsQuery, dict(params, cursor = pageInfo["endCursor"]), owner + "/" + repo)
+            if not data or not data["repository"]:
+                break
+            names += [node["name"] for node in data["repository"]["refs"]["nodes"]]
+            pageInfo = data["repository"]["refs"]["pageInfo"]
+        if self.cache and default:
+            self.cache.setDefault(owner, repo, default)
+        return selectBranches(self.branches, names, default)
+
+    def fetchBranches(self, repo, owner, branches = None, history = None):
+        #Yield every commit on the selected branches of owner/repo, resolving them first unless given. history may
+        #hold the already fetched first page of the first branch. Branches after the first stop where they join
+        #history already read, so shared history is only fetched once
+        if branches is None:
+            branches = self.resolveBranches(repo, owner)
+        walked = set()
+        for branch in branches:
+            if self.cache:
+                yield from self.cachedHistory(repo, owner, branch, history)
+            else:
+                yield from self.fetchHistory(repo, owner, branch, history, walked = walked)
+            history = None
+
+    def batchQuery(self, batch, selection, params):
+        #Pack one aliased repository(...) lookup per (repo, owner, branch) into a single request, a branch of None
+        #declares no branch variable for that lookup
+        declarations = ["$" + name + ": GitTimestamp" for name in params]
+        lookups = []
+        params = dict(params)
+        for i, (repo, owner, branch) in enumerate(batch):
+            declarations += ["$repo%d: String!" % i, "$owner%d: String!" % i]
+            if branch is not None:
+                declarations.append("$branch%d: String!" % i)
+                params["branch%d" % i] = branch
+            lookups.append("  r%d: repository(name: $repo%d, owner: $owner%d){%s  }" % (i, i, i, selection % {"i":i}))
+            params["repo%d" % i] = repo
+            params["owner%d" % i] = owner
+        query = "query(" + ", ".join(declarations) + ")\n{" + rateLimitFields + "\n".join(lookups) + "\n}"
+        #Lookups of invalid combinations come back null alongside NOT_FOUND errors, the rest is still usable
+        #each lookup costs about a point
+        return self.scheduler.post(self.url, query, params, "batch of %d" % len(batch), len(batch))
+
+    def fetchBatch(self, batch):
+        #Resolve which combinations of the batch exist, and which of their branches are selected, with a cheap
+        #lookup, then fetch the first history page of only those together, so dead combinations never cost history
+        #rate limit points. A single named branch is simply looked up, anything else lists the branches
+        if self.resolving or len(self.branches) > 1:
+            data = self.batchQuery([(repo, owner, None) for repo, owner in batch], refsSelection, {})
+        else:
+            data = self.batchQuery([(repo, owner, self.branches[0]) for repo, owner in batch], existsSelection, {})
+        if data is None:
+            print("Skipping", len(batch), "owner/repo combinations")
+            return []
+        targets = []
+        for i, (repo, owner) in enumerate(batch):
+            lookup = data["r%d" % i]
+            if not lookup:
+                continue
+            if "refs" in lookup:
+                branches = self.resolveBranches(repo, owner, lookup)
+            else:
+                branches = self.branches if lookup["ref"] else []
+            if branches:
+                targets.append((repo, owner, branches))
+        if not targets:
+            return []
+        if self.cache:
+            #cached branches each resume from their own newest commit, so their first pages can't be shared
+            return [(repo, owner, branches, None) for repo, owner, branches in targets]
+        since, until = self.historyWindow()
+        data = self.batchQuery([(repo, owner, branches[0]) for repo, owner, branches in targets], firstPageSelection,
+            {"since":since, "until":until})
+        if data is None:
+            #the first pages can still be fetched one repository at a time
+            return [(repo, owner, branches, None) for repo, owner, branches in targets]
+        heads = []
+        for i, (repo, owner, branches) in enumerate(targets):
+            if data["r%d" % i] and data["r%d" % i]["ref"]:
+                heads.append((repo, owner, branches, data["r%d" % i]["ref"]["target"]["history"]))
+            elif len(branches) > 1:
+                heads.append((repo, owner, branches[1:], None))
+        return heads
+
+    def cachedHistory(self, repo, owner, branch, history = None):
+        #Bring the cached copy of branch of owner/repo up to date, then replay it from disk. The whole history is cached
+        #regardless of --startTime/--endTime so that any window can be re-run offline, ingestCommit filters it
+        if not self.args.offline:
+            head = self.cache.head(owner, repo, branch)
+            run = head[2] + 1 if head else 0
+            newest = None
+            #the cache keeps every branch whole, but fetching stops at the first page made up entirely of commits already
+            #cached, as fetchPages does. Where that page holds commits cached under another branch the join is recorded
+            #and the rest of the history replayed from that branch, so shared history is only fetched once and any
+            #subset of branches can still be replayed offline. History order is no first parent walk, so every commit
+            #of the pages before is stored, including those of other branches, or the branch's own commits older than
+            #a merge of another branch would be lost. Commits merged since the last run can be older than the newest
+            #cached one, so the whole history is paged rather than a window ending at it. A cached branch, or one
+            #joining another, usually stops within its first page, prefetching would mostly waste a request
+            joinable = any(name != branch for name in self.cache.branches(owner, repo)[1])
+            for history in self.fetchPages(repo, owner, branch, history, (None, None), prefetch = not head and not joinable, shared = True):
+                commits = [edge["node"] for edge in history["edges"]]
+                cached = self.cache.cachedBranches(owner, repo, branch, [commit["oid"] for commit in commits])
+                if commits and all(commit["oid"] in cached for commit in commits):
+                    joins = [commit["oid"] for commit in commits if cached[commit["oid"]] != branch]
+                    if joins:
+                        self.cache.setJoin(owner, repo, branch, run, joins[0], cached[joins[0]])
+                        self.profiler.count("historiesJoined")
+                    else:
+                        self.profiler.count("pagesCached")
+                    if not head:
+                        newest = commits[0]#a new branch entirely made up of another's still needs its head
+                    break
+                if newest is None:
+                    newest = commits[0] if commits else None
+                self.cache.store(owner, repo, branch, run, [commit for commit in commits if cached.get(commit["oid"]) != branch])
+            if newest:
+                self.cache.setHead(owner, repo, branch, run, newest)
+        yield from self.cache.history(owner, repo, branch)
+
+    def ingestCommit(self, commit, repository):
+        size = len(self.commits)
+        self.profiler.count(ingestCommit(self.commits, commit, repository, self.args.startTime, self.args.endTime))
+        if self.export and len(self.commits) > size:
+            self.export.writeTable(self.commits, size)
+
+    def getLocalStats(self, repos):
+        #Repos are working copies inside --addr, or the current directory, anything without a .git is skipped
+        base = os.curdir
+        if self.args.addr and os.path.isdir(self.args.addr):
+            base = self.args.addr
+        repos = [repo for repo in repos if os.path.exists(os.path.join(base, repo, ".git"))]
+        paths = [os.path.join(base, repo) for repo in repos]
+        branches = [selectBranches(self.branches, localBranches(path), None) if self.resolving else self.branches for path in paths]
+        #git log without a branch would read HEAD, skip repos none of whose branches were selected
+        repos, paths, branches = [[column[i] for i in range(len(repos)) if branches[i]] for column in (repos, paths, branches)]
+        #git filters on committer dates, see historyWindow for why only the start is passed on
+        pad = 24*60*60
+        since = self.args.startTime - pad if self.args.startTime - pad > 0 else None
+        if self.args.workers > 1:
+            #each worker ingests a repository into a table of its own, folded in repository order as in the serial path
+            with concurrent.futures.ProcessPoolExecutor(max_workers = self.args.workers) as executor:
+                for table, outcomes in executor.map(readLocalTable, paths, repos, branches, itertools.repeat(since),
+                    itertools.repeat(self.args.startTime), itertools.repeat(self.args.endTime), itertools.repeat(self.args.maxWords)):
+                    start = len(self.commits)
+                    self.commits.extend(table)
+                    #commits another repository already delivered are dropped by extend
+                    duplicates = len(table) - (len(self.commits) - start)
+                    outcomes["commitsIngested"] -= duplicates
+                    outcomes["commitsDuplicate"] += duplicates
+                    for name, amount in outcomes.items():
+                        self.profiler.count(name, amount)
+                    if self.export:
+                        self.export.writeTable(self.commits, start)
+        else:
+            for repo, path, selected in zip(repos, paths, branches):
+                for commit in localHistory(path, selected, since):
+                    self.ingestCommit(commit, repo)
+
+    def streamHistories(self, executor, heads, fetch):
+        #Run fetch for every head on the executor, yielding (head, commit) in head order so users are merged exactly
+        #as in the serial path. Workers hand pages over through small bounded queues, a worker that gets ahead of
+        #ingest waits instead of buffering a whole history
+        abandoned = threading.Event()
+        def handOver(pages, page):
+            while not abandoned.is_set():
+                try:
+                    pages.put(page, timeout = 0.1)
+                    return
+                except queue.Full:
+                    pass
+        def produce(head, pages):
+            try:
+                page = []
+                for commit in fetch(*head):
+                    page.append(commit)
+                    if len(page) == 100:
+                        handOver(pages, page)
+                        page = []
+                    if abandoned.is_set():
+                        return
+                handOver(pages, page)
+            finally:
+                handOver(pages, None)
+        streams = []
+        for head in heads:
+            pages = queue.Queue(maxsize = 4)
+            streams.append((head, executor.submit(produce, head, pages), pages))
+        try:
+            for head, future, pages in streams:
+                page = pages.get()
+                while page is not None:
+                    for commit in page:
+                        yield head, commit
+                    page = pages.get()
+                future.result()#raise anything the worker ran into
+        finally:
+            #if ingest stopped early, release workers still waiting to hand over pages
+            abandoned.set()
+            for head, future, pages in streams:
+                future.cancel()
+
+    def getRemoteStats(self, repos):
         #Load List of Repository Owners
         owners = self.args.owners.split(',')
 
-        for repo in repos:
-            for owner in owners:
-                params = {"repo":repo,"owner":owner, 'branch':self.args.branch}
-                response = self.session.post(self.url,json={'query':queryBase, 'variables':params})
-                data = json.loads(response.text)
-                data = data["data"]["repository"]
+        targets = [(repo, owner) for repo in repos for owner in owners]
+        batches = [targets[i:i+self.args.batchSize] for i in range(0, len(targets), self.args.batchSize)]
+        batched = self.args.batchSize > 1 and not self.args.offline
+        self.prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers = self.args.workers)
+        try:
+            if self.args.workers > 1:
+                with concurrent.futures.ThreadPoolExecutor(max_workers = self.args.workers) as executor:
+                    if batched:
+                        heads = [head for heads in executor.map(self.fetchBatch, batches) for head in heads]
+                    else:
+                        heads = [(repo, owner, None, None) for repo, owner in targets]
+                    for (repo, owner, branches, history), commit in self.streamHistories(executor, heads, self.fetchBranches):
+                        self.ingestCommit(commit, owner + "/" + repo)
+            else:
+                if batched:
+                    heads = (head for batch in batches for head in self.fetchBatch(batch))
+                else:
+                    heads = ((repo, owner, None, None) for repo, owner in targets)
+                for repo, owner, branches, history in heads:
+                    for commit in self.fetchBranches(repo, owner, branches, history):
+                        self.ingestCommit(commit, owner + "/" + repo)
+        finally:
+            self.prefetcher.shutdown()
+            self.prefetcher = None
 
-                if not data: #if the owner/repository combination is invalid, conitnue to next
-                    continue
+    def getStats(self):
+        repos = self.getRepos()
+        if repos is None:
+            return
+        #CSV exports are streamed while ingesting, .npz columns are written from the commit table afterwards
+        if self.args.commitExport and not self.args.commitExport.endswith(".npz"):
+            self.export = commitExport(self.args.commitExport)
+        try:
+            if self.args.local:
+                self.getLocalStats(repos)
+            else:
+                self.getRemoteStats(repos)
+        finally:
+            if self.export:
+                self.export.close()
+                self.export = None
+        with self.profiler.phase("summarize", self.args.profile):
+            self.summary = self.commits.summaryArrays()
+            self.users = self.commits.summarize(summary = self.summary)
 
-                data = data["ref"]
-                if not data:
-                    continue
+    def query(self, start = None, end = None, authors = None, repositories = None, perUser = False, awards = False):
+        #Aggregates of the ingested commits made in [start, end) epoch seconds, by any of authors and in any of
+        #repositories when given, answered from the commit index without fetching again. Repositories are named
+        #owner/repo, or by directory with --local. Commits outside --startTime/--endTime were never ingested.
+        #perUser adds the per user lists for just those commits, awards the award winners among them
+        rows = self.commits.select(start, end, authors, repositories)
+        column = lambda name: self.commits.column(name)[rows]
+        hour = column("hour")
+        result = {"commits":len(rows), "additions":int(column("additions").sum()), "deletions":int(column("deletions").sum()),
+            "weekdays":np.bincount(column("weekday"), minlength = 7).tolist(),
+            "nightOwl":int(np.count_nonzero(hour >= 20)), "earlyBird":int(np.count_nonzero(hour <= 8))}
+        if perUser or awards:
+            summary = self.commits.summaryArrays(rows)
+            if perUser:
+                result["users"] = self.commits.summarize(summary = summary)
+            if awards:
+                result["awards"] = self.scoreAwards(summary) if summary["names"] else {}
+        return result
 
-                #parse data from response for each commit
-                data = data["target"]["history"]["edges"]
-                for commit in data:
-                    try:
+    def mergePartials(self):
+        #Partials combine in the order given exactly as if their repositories had been fetched in one run
+        for path in self.args.partials:
+            self.commits.extend(commitTable.load(path, self.args.maxWords))
+        self.summary = self.commits.summaryArrays()
+        self.users = self.commits.summarize(summary = self.summary)
 
-                        commit = commit['node']
-                        
-                        date = commit["author"]["date"]
-                        commitDate = date.split('T')[0].split("-")
-                        commitTime = date.split('T')[1].split(":")
-                        weekdayCheck = datetime.datetime(int(commitDate[0]),int(commitDate[1]),int(commitDate[2]),int(commitTime[0]),int(commitTime[1]))
-                        sinceEpoch = weekdayCheck.timestamp()
-                        if not (self.args.startTime <= sinceEpoch < self.args.endTime):
-                            continue
-                        weekdayCheck = weekdayCheck.weekday()#returns the day of week as an int 0=monday
-
-                        nightOwl = 0
-                        earlyBird = 0
-                        if(int(commitTime[0])>=20):
-                            nightOwl = 1
-                        else:
-                            if(int(commitTime[0])<=8):
-                                earlyBird = 1
-
-                        author = commit["author"]["name"]
-                        commitMessage = commit["message"]
-                        additions = commit["additions"]
-                        deletions = commit["deletions"]
-                    except AttributeError:
-                        continue
-
-                    if author not in self.users:
-                        #create a new user with new data
-                        weekdayCommitCount = [0,0,0,0,0,0,0]
-                        weekdayCommitCount[weekdayCheck]+=1
-                        commits = 1
-                        commitTimes = [sinceEpoch]
-                        shortestCommit = commitMessage
-                        longestCommit = commitMessage
-                        self.users[author] = [additions, deletions,commits,commitMessage, weekdayCommitCount,commitTimes,nightOwl,earlyBird,shortestCommit,longestCommit]
-                    else:
-                        #overwrite an existing user with combined data
-                        user = self.users.get(author)
-
-                        shortestCommit = user[8]
-                        if len(commitMessage) < len(shortestCommit):
-                            shortestCommit = commitMessage
-                        longestCommit = user[9]
-                        if len(commitMessage) > len(longestCommit):
-                            longestCommit = commitMessage
-
-                        additions += user[0]
-                        deletions += user[1]
-                        commits = user[2] + 1
-                        commitMessage += user[3]
-                        weekdayCommitCount = user[4]
-                        weekdayCommitCount[weekdayCheck]+=1
-                        commitTimes = user[5] + [sinceEpoch]
-                        commitTimes.sort()
-                        nightOwl += user[6]
-                        earlyBird += user[7]
-                        self.users[author] = [additions, deletions,commits,commitMessage, weekdayCommitCount,commitTimes,nightOwl,earlyBird,shortestCommit,longestCommit]
+    def exportCommits(self):
+        #Export every commit in the commit table, for merged partials or the columnar format which aren't streamed
+        if self.args.commitExport.endswith(".npz"):
+            self.commits.export(self.args.commitExport)
+            return
+        export = commitExport(self.args.commitExport)
+        try:
+            export.writeTable(self.commits)
+        finally:
+            export.close()
 
     def execute(self):
-        self.getStats()
+        profile = self.args.profile
+        if self.merging:
+            with self.profiler.phase("mergePartials", profile):
+                self.mergePartials()
+        else:
+            with self.profiler.phase("getStats", profile):
+                self.getStats()
+        if self.args.commitExport and (self.merging or self.args.commitExport.endswith(".npz")):
+            with self.profiler.phase("exportCommits", profile):
+                self.exportCommits()
+        if self.args.emitPartial:
+            with self.profiler.phase("emitPartial", profile):
+                self.commits.save(self.args.emitPartial)
         if self.users != {}:
             if self.args.wordCloud:
-                self.makeWordCloud()
+                with self.profiler.phase("makeWordCloud", profile):
+                    self.makeWordCloud()
             if self.args.graphStats:
-                self.graphStats()
+                with self.profiler.phase("graphStats", profile):
+                    self.graphStats()
             if self.args.csv:
-                self.makeCSV()
+                with self.profiler.phase("makeCSV", profile):
+                    self.makeCSV()
+            if self.args.repoReports:
+                with self.profiler.phase("makeRepoReports", profile):
+                    self.makeRepoReports()
             if self.args.awards:
-                self.grantAwards()
+                with self.profiler.phase("grantAwards", profile):
+                    self.grantAwards()
+        if profile:
+            self.profiler.write(profile, self.args)
 
 if __name__ == "__main__":
     engine = gitStatistics(sys.argv[1:])
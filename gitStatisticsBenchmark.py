@@ -0,0 +1,229 @@
+import argparse
+import os
+import io
+import re
+import sys
+import json
+import time
+import random
+import datetime
+import resource
+import tempfile
+import statistics
+import subprocess
+import threading
+import contextlib
+import http.server
+from gitStatistics import gitStatistics
+
+#Words synthetic commit messages are drawn from, a few are stopwords so filtering is exercised too
+vocabulary = ["fix", "add", "remove", "update", "refactor", "tests", "docs", "parser", "cache", "build", "release",
+    "merge", "branch", "config", "the", "a", "to", "for", "and", "typo", "bug", "feature", "api", "query", "page",
+    "cursor", "rate", "limit", "worker", "report", "graph", "cloud", "award", "user", "commit", "history"]
+
+class syntheticHistory:
+    #Deterministic fake commit histories for owner/repo0 .. owner/repoN, generated on first use. Each repository has
+    #a default branch main and branch1 .. branchN, feature branches whose own commits sit on top of main's history
+    def __init__(self, owner, repos, commits, authors, messageWords, seed, branches = 0, branchCommits = 20):
+        self.owner = owner
+        self.repos = repos
+        self.commits = commits
+        self.authors = authors
+        self.messageWords = messageWords
+        self.seed = seed
+        self.branches = branches
+        self.branchCommits = branchCommits
+        self.histories = {}
+        self.lock = threading.Lock()
+
+    def history(self, owner, repo):
+        #Branch name -> commits newest first, as GitHub returns them, or None if the repository doesn't exist
+        match = re.fullmatch(r"repo(\d+)", repo)
+        if owner != self.owner or not match or int(match.group(1)) >= self.repos:
+            return None
+        with self.lock:
+            if repo not in self.histories:
+                index = int(match.group(1))
+                main = self.generate(index, 0, self.commits)
+                self.histories[repo] = {"main":main}
+                for branch in range(1, self.branches + 1):
+                    self.histories[repo]["branch%d" % branch] = self.generate(index, branch, self.branchCommits) + main
+            return self.histories[repo]
+
+    def generate(self, index, branch, commits):
+        generator = random.Random((self.seed*100003 + index)*1009 + branch)
+        #branch commits are newer than anything on main
+        date = datetime.datetime(2021, 1, 1 + (branch > 0), tzinfo = datetime.timezone.utc)
+        history = []
+        for i in range(commits):
+            date -= datetime.timedelta(seconds = generator.expovariate(1/(6*60*60)))
+            offset = datetime.timezone(datetime.timedelta(hours = generator.choice([-8, -5, 0, 1, 2, 5.5, 9])))
+            #message lengths follow a log normal distribution around messageWords
+            words = max(1, int(generator.lognormvariate(0, 0.8)*self.messageWords))
+            history.append({"oid":"%040x" % generator.getrandbits(160),
+                "message":" ".join(generator.choice(vocabulary) for word in range(words)),
+                "additions":int(generator.paretovariate(1.2)*10), "deletions":int(generator.paretovariate(1.4)*5),
+                "author":{"name":"author%d" % int(generator.triangular(0, self.authors, 0)), "date":date.astimezone(offset).isoformat()}})
+        return history
+
+class mockGraphQL(http.server.ThreadingHTTPServer):
+    #Local stand in for /api/graphql, answering the queries gitStatistics sends from a syntheticHistory
+    daemon_threads = True
+
+    def __init__(self, histories, latency):
+        super().__init__(("127.0.0.1", 0), mockGraphQLHandler)
+        self.histories = histories
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def hostname(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def refs(self, owner, repo):
+        #The defaultBranchRef and refs(...) part of a query, every branch fits in one page
+        branches = self.histories.history(owner, repo)
+        if branches is None:
+            return None
+        return {"defaultBranchRef":{"name":"main"}, "refs":{"pageInfo":{"hasNextPage":False, "endCursor":None},
+            "nodes":[{"name":name} for name in branches]}}
+
+    def history(self, owner, repo, branch, variables, cursor = None):
+        #One page of history the way the ref(...) { target } part of a query returns it
+        branches = self.histories.history(owner, repo)
+        if branches is None:
+            return None
+        history = branches.get(branch)
+        if history is None:
+            return {"ref":None}
+        since = variables.get("since")
+        until = variables.get("until")
+        if since or until:
+            since = datetime.datetime.fromisoformat(since.replace("Z", "+00:00")) if since else None
+            until = datetime.datetime.fromisoformat(until.replace("Z", "+00:00")) if until else None
+            history = [commit for commit in history if (since is None or datetime.datetime.fromisoformat(commit["author"]["date"]) >= since)
+                and (until is None or datetime.datetime.fromisoformat(commit["author"]["date"]) <= until)]
+        start = int(cursor or 0)
+        page = history[start:start+100]
+        return {"ref":{"target":{"id":repo, "oid":page[0]["oid"] if page else None, "history":{
+            "pageInfo":{"hasNextPage":start + 100 < len(history), "endCursor":str(start + 100)},
+            "edges":[{"node":commit} for commit in page]}}}}
+
+    def answer(self, query, variables):
+        data = {"rateLimit":{"cost":1, "remaining":5000, "resetAt":"2100-01-01T00:00:00Z"}}
+        if "repo0" in variables:
+            #batched lookups, one aliased repository(...) per owner/repo combination
+            for alias in re.findall(r"(r\d+): repository", query):
+                i = alias[1:]
+                if "refs(" in query:
+                    data[alias] = self.refs(variables["owner" + i], variables["repo" + i])
+                else:
+                    data[alias] = self.history(variables["owner" + i], variables["repo" + i], variables["branch" + i], variables)
+        elif "refs(" in query:
+            data["repository"] = self.refs(variables["owner"], variables["repo"])
+        else:
+            data["repository"] = self.history(variables["owner"], variables["repo"], variables["branch"], variables, variables.get("cursor"))
+        return {"data":data}
+
+class mockGraphQLHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        response = json.dumps(self.server.answer(body["query"], body["variables"])).encode()
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes += len(response)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+def peakRSS():
+    #Peak resident set size of this process so far, in MB. ru_maxrss is KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/1024/1024 if sys.platform == "darwin" else peak/1024
+
+def measureStartup(runs):
+    #Wall time of a fresh interpreter importing gitStatistics, the fixed cost every cron run and worker process pays,
+    #as the median over runs. Also reports which of the heavy optional modules got imported along the way
+    check = "import sys, gitStatistics; print(','.join(name for name in ('matplotlib', 'wordcloud') if name in sys.modules))"
+    directory = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", check], cwd = directory, stdout = subprocess.PIPE,
+            universal_newlines = True, check = True).stdout
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), [name for name in output.strip().split(",") if name]
+
+def initArgParser():
+    #Arguments not recognized here are passed on to gitStatistics, e.g. --workers 8 --batchSize 20
+    argParser = argparse.ArgumentParser(description='Times each phase of gitStatistics against a local mock GraphQL server serving synthetic repositories, other arguments are passed on to gitStatistics', allow_abbrev = False)
+    argParser.add_argument("--repos", type = int, default = 20, help = 'Number of synthetic repositories, default is 20')
+    argParser.add_argument("--commits", type = int, default = 1000, help = 'Commits per repository, default is 1000')
+    argParser.add_argument("--authors", type = int, default = 50, help = 'Number of distinct authors, default is 50')
+    argParser.add_argument("--messageWords", type = float, default = 8, help = 'Median words per commit message, lengths are log normally distributed, default is 8')
+    argParser.add_argument("--latency", type = float, default = 0, help = 'Milliseconds the server waits before answering each request, default is 0')
+    argParser.add_argument("--branches", type = int, default = 0, help = 'Feature branches per repository besides main, each adding --branchCommits commits on top of main, default is 0')
+    argParser.add_argument("--branchCommits", type = int, default = 20, help = 'Commits of each feature branch not on main, default is 20')
+    argParser.add_argument("--invalidOwners", type = int, default = 0, help = 'Extra owners that own none of the repositories, to exercise dead combinations')
+    argParser.add_argument("--seed", type = int, default = 1, help = 'Seed of the synthetic histories')
+    argParser.add_argument("--phases", default = "getStats,grantAwards,graphStats,makeWordCloud,makeCSV", help = 'Comma separated phases to time, in order')
+    argParser.add_argument("--startupRuns", type = int, default = 5, help = 'Fresh interpreters timed importing gitStatistics, 0 skips the startup measurement, default is 5')
+    argParser.add_argument("--startupTarget", type = float, default = 0.5, help = 'Seconds the median startup should stay under, default is 0.5')
+    argParser.add_argument("--json", help = 'Also write the results to this JSON file')
+    return argParser
+
+def benchmark(args, options):
+    histories = syntheticHistory("benchmark", args.repos, args.commits, args.authors, args.messageWords, args.seed,
+        args.branches, args.branchCommits)
+    server = mockGraphQL(histories, args.latency/1000)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    owners = ",".join(["benchmark"] + ["nobody%d" % i for i in range(args.invalidOwners)])
+    repos = ",".join("repo%d" % i for i in range(args.repos))
+    results = {"parameters":dict(vars(args), options = options), "phases":[]}
+    if args.startupRuns:
+        seconds, imported = measureStartup(args.startupRuns)
+        results["startup"] = {"seconds":seconds, "target":args.startupTarget, "met":seconds <= args.startupTarget, "imported":imported}
+    workingDirectory = os.getcwd()
+    with tempfile.TemporaryDirectory() as outputDirectory:
+        #reports are written to the current directory, keep them and the repository listing out of the way
+        os.chdir(outputDirectory)
+        try:
+            engine = gitStatistics(["benchmark", owners, "--hostname", server.hostname(), "--repos", repos] + options)
+            for phase in args.phases.split(","):
+                requests, received = server.requests, server.bytes
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    getattr(engine, phase)()
+                results["phases"].append({"phase":phase, "seconds":time.perf_counter() - start, "peakRSS":peakRSS(),
+                    "requests":server.requests - requests, "bytes":server.bytes - received})
+        finally:
+            os.chdir(workingDirectory)
+            server.shutdown()
+    results["commits"] = len(engine.commits)
+    results["users"] = len(engine.users)
+    return results
+
+if __name__ == "__main__":
+    args, options = initArgParser().parse_known_args()
+    results = benchmark(args, options)
+    print("%-15s %10s %12s %10s %14s" % ("Phase", "Seconds", "Peak RSS MB", "Requests", "Bytes"))
+    for phase in results["phases"]:
+        print("%-15s %10.3f %12.1f %10d %14d" % (phase["phase"], phase["seconds"], phase["peakRSS"], phase["requests"], phase["bytes"]))
+    print(results["commits"], "commits from", results["users"], "users")
+    if "startup" in results:
+        startup = results["startup"]
+        line = "Startup %.3f seconds, target %.3f %s" % (startup["seconds"], startup["target"], "met" if startup["met"] else "MISSED")
+        if startup["imported"]:
+            line += ", imported " + ", ".join(startup["imported"])
+        print(line)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent = 2)